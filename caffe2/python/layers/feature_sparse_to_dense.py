@@ -27,95 +27,73 @@ from caffe2.python.layers.layers import (
 import numpy as np
 
 
+# Output field name, source blob accessor on the input `values` struct and
+# dtype of every blob passed through by the id list flavoured feature types.
+_ID_LIST_VALUES = {
+    'ID_LIST': [('values', 'items', np.int64)],
+    'ID_SCORE_LIST': [('ids', 'keys', np.int64),
+                      ('scores', 'values', np.float32)],
+}
+
+
 class FeatureSparseToDense(ModelLayer):
-    _known_types = ['FLOAT', 'ID_LIST']
+    # ModelLayer keeps its own attributes (including the output_schema
+    # property storage) in the instance dict; only the state owned by this
+    # layer is slotted.
+    __slots__ = (
+        'input_specs', 'zero', 'zero_range', '_strict_alias',
+        '_fields', '_types', '_nids',
+        '_masks', '_metadata',
+    )
 
     def __init__(self, model, input_record, input_specs,
-                 name='feature_sparse_to_dense', **kwargs):
+                 name='feature_sparse_to_dense', strict_alias=True,
+                 **kwargs):
         """
         `input_specs` follows the format of FeatureSpec from schema. To be more
         precise it's a namedtuple that should have:
             'feature_type', 'feature_names', 'feature_ids'
+
+        With `strict_alias` set to False, the values of ID_LIST and
+        ID_SCORE_LIST outputs reuse the input blobs directly instead of being
+        produced by an Alias op into a new blob.
         """
+        unsupported = [
+            (field, feature_specs.feature_type)
+            for field, feature_specs in input_specs
+            if feature_specs.feature_type not in self._KNOWN_TYPES
+        ]
+        if unsupported:
+            raise TypeError(
+                "Unsupported input types: {0}".format(unsupported))
+
         super(FeatureSparseToDense, self).__init__(model, name,
                                             input_record, **kwargs)
 
         self.input_specs = input_specs
+        self._strict_alias = strict_alias
+        # Every phase below only needs a couple of attributes of each spec, so
+        # keep them column-wise as well.
+        self._fields = tuple(field for field, _ in input_specs)
+        self._types = tuple(
+            feature_specs.feature_type for _, feature_specs in input_specs)
+        self._nids = tuple(
+            len(feature_specs.feature_ids) for _, feature_specs in input_specs)
+        self._masks = tuple(
+            tuple(feature_specs.feature_ids)
+            for _, feature_specs in input_specs
+        )
 
-        outputs = []
-        for field, feature_specs in self.input_specs:
-            assert len(feature_specs.feature_names) ==\
-                len(feature_specs.feature_ids)
-            if feature_specs.feature_type == 'FLOAT':
-                outputs.append((
-                    field,
-                    schema.Scalar(
-                        (np.float32, (len(feature_specs.feature_ids), )),
-                        self.get_next_blob_reference(field + '_output')
-                    )
-                ))
-            elif feature_specs.feature_type == 'ID_LIST':
-                outputs.append((
-                    field,
-                    schema.Struct(
-                        ('ranges',
-                            schema.Scalar(
-                                (
-                                    np.int32,
-                                    (len(feature_specs.feature_ids), 2)
-                                ),
-                                self.get_next_blob_reference(
-                                    field + '_ranges')
-                            ),
-                         ),
-                        ('values',
-                         schema.Scalar(np.int64,
-                                       self.get_next_blob_reference(
-                                           field + '_values')
-                                       ),
-                         )
-                    )
-                ))
-            elif feature_specs.feature_type == 'ID_SCORE_LIST':
-                outputs.append((
-                    field,
-                    schema.Struct(
-                        ('ranges',
-                            schema.Scalar(
-                                (
-                                    np.int32,
-                                    (len(feature_specs.feature_ids), 2)
-                                ),
-                                self.get_next_blob_reference(
-                                    field + '_ranges')
-                            ),
-                         ),
-                        ('ids',
-                         schema.Scalar(np.int64,
-                                       self.get_next_blob_reference(
-                                           field + '_ids')
-                                       ),
-                         ),
-                        ('scores',
-                         schema.Scalar(np.float32,
-                                       self.get_next_blob_reference(
-                                           field + '_scores')
-                                       ),
-                         )
-                    )
-                ))
-            else:
-                raise TypeError(
-                    "Unsupported input type: {0}".
-                    format(feature_specs.feature_type))
+        for (_, feature_specs), nids in zip(input_specs, self._nids):
+            assert len(feature_specs.feature_names) == nids
 
         # TODO(amalevich): This schema is producing ranges. And thus if there is
         # something using it it should support ranges as well. It might be
         # confusing, if we don't add better support for ranges/have it as a
         # first layer
-        self.output_schema = schema.Struct(
-            *outputs
-        )
+        self.output_schema = schema.Struct(*(
+            self._output_for(i) for i in range(len(self._fields))
+        ))
 
         # TODO(amalevich): Consider moving this data to schema, instead
         # Structs doens't support attaching metadata to them and clonning
@@ -131,81 +109,140 @@ class FeatureSparseToDense(ModelLayer):
         self.zero = model.global_constants['ZERO']
         self.zero_range = model.global_constants['ZERO_RANGE']
 
+        # input_specs and output_schema are fixed from here on, so the
+        # metadata can be computed once instead of on every request.
+        self._metadata = self._build_metadata()
+
     # Add operators to all types that need to be densified
     def add_ops(self, net):
-        record = self.input_record
-        for field, feature_specs in self.input_specs:
-            if feature_specs.feature_type == 'FLOAT':
-                net.SparseToDenseMask(
-                    [
-                        record[field].keys(),
-                        record[field].values(),
-                        self.zero,
-                        record[field].lengths(),
-                    ],
-                    [
-                        self.output_schema[field](),
-                    ],
-                    mask=feature_specs.feature_ids,
-                )
-            elif feature_specs.feature_type == 'ID_LIST':
-                id_list_ranges = net.LengthsToRanges(
-                    record[field].values.lengths(),
-                    net.NextScopedBlob('id_list_ranges')
-                )
-                net.SparseToDenseMask(
-                    [
-                        record[field].keys(), id_list_ranges, self.zero_range,
-                        record[field].lengths()
-                    ],
-                    self.output_schema[field].ranges(),
-                    mask=feature_specs.feature_ids,
-                )
-                # Alias helps to enforce the fact that all SparseToDense calls
-                # produce new blobs.
-                # Reusing blob names might result in some weird consequences
-                # during the delivery time, when content of the blobs is
-                # generated based on the inputSpecs.
-                net.Alias(record[field].values.items(),
-                          self.output_schema[field].values())
-            elif feature_specs.feature_type == 'ID_SCORE_LIST':
-                # TODO: merge this to the case above?
-                id_list_ranges = net.LengthsToRanges(
-                    record[field].values.lengths(),
-                    net.NextScopedBlob('id_score_list_ranges')
-                )
-                net.SparseToDenseMask(
-                    [
-                        record[field].keys(), id_list_ranges, self.zero_range,
-                        record[field].lengths()
-                    ],
-                    self.output_schema[field].ranges(),
-                    mask=feature_specs.feature_ids,
-                )
-                # Alias helps to enforce the fact that all SparseToDense calls
-                # produce new blobs.
-                # Reusing blob names might result in some weird consequences
-                # during the delivery time, when content of the blobs is
-                # generated based on the inputSpecs.
-                net.Alias(record[field].values.keys(),
-                          self.output_schema[field].ids())
-                net.Alias(record[field].values.values(),
-                          self.output_schema[field].scores())
+        # Id list features frequently share the same outer lengths blob, so
+        # only convert each distinct one to ranges once.
+        ranges_cache = {}
+        # SparseToDenseMask densifies row by row against a single mask, so
+        # every field keeps its own op; they are emitted in input_specs order.
+        for i, feature_type in enumerate(self._types):
+            self._TYPE_TO_OPS[feature_type](self, net, i, ranges_cache)
+
+    def _output_for(self, i):
+        return (
+            self._fields[i],
+            self._TYPE_TO_OUTPUT[self._types[i]](self, i)
+        )
+
+    def _build_float_output(self, i):
+        return schema.Scalar(
+            (np.float32, (self._nids[i], )),
+            self.get_next_blob_reference(self._fields[i] + '_output')
+        )
+
+    def _build_id_list_output(self, i):
+        field = self._fields[i]
+        return schema.Struct(
+            ('ranges',
+                schema.Scalar(
+                    (np.int32, (self._nids[i], 2)),
+                    self.get_next_blob_reference(field + '_ranges')
+                ),
+             ),
+            *[
+                (name,
+                 schema.Scalar(dtype,
+                               self._id_list_value_blob(field, name, source)
+                               ),
+                 )
+                for name, source, dtype in _ID_LIST_VALUES[self._types[i]]
+            ]
+        )
+
+    def _id_list_value_blob(self, field, name, source):
+        if self._strict_alias:
+            return self.get_next_blob_reference(field + '_' + name)
+        return getattr(self.input_record[field].values, source)()
+
+    def _emit_float_ops(self, net, i, ranges_cache):
+        field = self._fields[i]
+        rec = self.input_record[field]
+        out = self.output_schema[field]
+        net.SparseToDenseMask(
+            [
+                rec.keys(),
+                rec.values(),
+                self.zero,
+                rec.lengths(),
+            ],
+            [
+                out(),
+            ],
+            mask=self._masks[i],
+        )
+
+    def _emit_id_list_ops(self, net, i, ranges_cache):
+        field = self._fields[i]
+        feature_type = self._types[i]
+        rec = self.input_record[field]
+        out = self.output_schema[field]
+        lengths_blob = rec.values.lengths()
+        id_list_ranges = ranges_cache.get(str(lengths_blob))
+        if id_list_ranges is None:
+            id_list_ranges = net.LengthsToRanges(
+                lengths_blob,
+                net.NextScopedBlob(
+                    feature_type.lower() + '_ranges')
+            )
+            ranges_cache[str(lengths_blob)] = id_list_ranges
+        net.SparseToDenseMask(
+            [
+                rec.keys(), id_list_ranges, self.zero_range,
+                rec.lengths()
+            ],
+            out.ranges(),
+            mask=self._masks[i],
+        )
+        if not self._strict_alias:
+            return
+        # Alias helps to enforce the fact that all SparseToDense calls
+        # produce new blobs.
+        # Reusing blob names might result in some weird consequences
+        # during the delivery time, when content of the blobs is
+        # generated based on the inputSpecs.
+        for name, source, _ in _ID_LIST_VALUES[feature_type]:
+            net.Alias(getattr(rec.values, source)(), out[name]())
 
     def get_metadata(self):
+        # Hand out fresh containers built from the cached metadata, so that
+        # callers mutating the result can't corrupt later calls.
+        return [
+            (dict(field_metadata), list(blobs), list(types))
+            for field_metadata, blobs, types in self._metadata
+        ]
+
+    def _build_metadata(self):
         metadata = []
         for field, feature_specs in self.input_specs:
+            field_metadata = {
+                'type': feature_specs.feature_type,
+                'names': feature_specs.feature_names,
+                'ids': feature_specs.feature_ids,
+            }
+            if feature_specs.feature_type == 'FLOAT':
+                field_metadata['cardinality'] = 1
+            out = self.output_schema[field]
             metadata.append(
-                (
-                    {
-                        'type': feature_specs.feature_type,
-                        'names': feature_specs.feature_names,
-                        'ids': feature_specs.feature_ids,
-                    },
-                    self.output_schema[field].field_blobs(),
-                    self.output_schema[field].field_types()
-                )
+                (field_metadata, out.field_blobs(), out.field_types())
             )
-            if feature_specs.feature_type == 'FLOAT':
-                metadata[-1][0]['cardinality'] = 1
         return metadata
+
+    # Per feature type output schema builders and op emitters. Op emitters
+    # share the (net, i, ranges_cache) signature; only the id list flavoured
+    # ones use the cache.
+    _TYPE_TO_OUTPUT = {
+        'FLOAT': _build_float_output,
+        'ID_LIST': _build_id_list_output,
+        'ID_SCORE_LIST': _build_id_list_output,
+    }
+    _TYPE_TO_OPS = {
+        'FLOAT': _emit_float_ops,
+        'ID_LIST': _emit_id_list_ops,
+        'ID_SCORE_LIST': _emit_id_list_ops,
+    }
+    _KNOWN_TYPES = frozenset(_TYPE_TO_OUTPUT) & frozenset(_TYPE_TO_OPS)
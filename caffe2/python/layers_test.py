@@ -1307,3 +1307,247 @@ class TestLayers(LayersTestCase):
         # Eval net assertions
         eval_net = self.get_eval_net()
         self.assertNetContainOps(eval_net, [conv_spec])
+
+    def testFeatureSparseToDenseSharedLengths(self):
+        input_record = self.new_record(schema.Struct(
+            ('id_list', schema.Map(np.int32, schema.List(np.int64))),
+            ('id_score_list',
+             schema.Map(np.int32, schema.Map(np.int64, np.float32))),
+        ))
+        # Make both fields share the same values.lengths blob
+        blobs = input_record.field_blobs()
+        blobs[6] = blobs[2]
+        input_record = schema.from_blob_list(input_record, blobs)
+
+        lengths = np.array([2, 1], dtype=np.int32)
+        keys = np.array([11, 12, 12], dtype=np.int32)
+        values_lengths = np.array([2, 3, 1], dtype=np.int32)
+        ids = np.arange(6, dtype=np.int64)
+        scores = np.arange(6, dtype=np.float32)
+        schema.FeedRecord(
+            input_record,
+            [lengths, keys, values_lengths, ids,
+             lengths, keys, values_lengths, ids, scores])
+
+        output = self.model.FeatureSparseToDense(
+            input_record,
+            [
+                ('id_list', schema.FeatureSpec(
+                    feature_type='ID_LIST',
+                    feature_names=['a', 'b'],
+                    feature_ids=[11, 12])),
+                ('id_score_list', schema.FeatureSpec(
+                    feature_type='ID_SCORE_LIST',
+                    feature_names=['b', 'a'],
+                    feature_ids=[12, 11])),
+            ]
+        )
+
+        _, train_net = self.get_training_nets()
+        op_types = [op.type for op in train_net.Proto().op]
+        self.assertEqual(op_types.count('LengthsToRanges'), 1)
+
+        self.run_train_net_forward_only()
+        npt.assert_array_equal(
+            [[[0, 2], [2, 3]], [[0, 0], [5, 1]]],
+            workspace.FetchBlob(output.id_list.ranges()))
+        npt.assert_array_equal(
+            [[[2, 3], [0, 2]], [[5, 1], [0, 0]]],
+            workspace.FetchBlob(output.id_score_list.ranges()))
+
+    def testFeatureSparseToDenseUnsupportedTypes(self):
+        input_record = self.new_record(schema.Struct(
+            ('float', schema.Map(np.int32, np.float32)),
+            ('id_list', schema.Map(np.int32, schema.List(np.int64))),
+            ('other', schema.Map(np.int32, np.float32)),
+        ))
+        with self.assertRaises(TypeError) as context:
+            self.model.FeatureSparseToDense(
+                input_record,
+                [
+                    ('float', schema.FeatureSpec(
+                        feature_type='FLOAT',
+                        feature_names=['a'],
+                        feature_ids=[1])),
+                    ('id_list', schema.FeatureSpec(
+                        feature_type='ID_LISTS',
+                        feature_names=['b'],
+                        feature_ids=[2])),
+                    ('other', schema.FeatureSpec(
+                        feature_type='DENSE',
+                        feature_names=['c'],
+                        feature_ids=[3])),
+                ]
+            )
+        message = str(context.exception)
+        self.assertIn('ID_LISTS', message)
+        self.assertIn('DENSE', message)
+        self.assertNotIn('FLOAT', message)
+
+    def _buildFeatureSparseToDenseIdLists(self, **kwargs):
+        input_record = self.new_record(schema.Struct(
+            ('id_list', schema.Map(np.int32, schema.List(np.int64))),
+            ('id_score_list',
+             schema.Map(np.int32, schema.Map(np.int64, np.float32))),
+        ))
+        output = self.model.FeatureSparseToDense(
+            input_record,
+            [
+                ('id_list', schema.FeatureSpec(
+                    feature_type='ID_LIST',
+                    feature_names=['a', 'b'],
+                    feature_ids=[11, 12])),
+                ('id_score_list', schema.FeatureSpec(
+                    feature_type='ID_SCORE_LIST',
+                    feature_names=['c'],
+                    feature_ids=[13])),
+            ],
+            **kwargs
+        )
+        _, train_net = self.get_training_nets()
+        alias_ops = [
+            op for op in train_net.Proto().op if op.type == 'Alias'
+        ]
+        return input_record, output, alias_ops
+
+    def testFeatureSparseToDenseStrictAlias(self):
+        input_record, output, alias_ops = \
+            self._buildFeatureSparseToDenseIdLists()
+
+        expected = [
+            (input_record.id_list.values.items(),
+             output.id_list.values(), 'id_list_values'),
+            (input_record.id_score_list.values.keys(),
+             output.id_score_list.ids(), 'id_score_list_ids'),
+            (input_record.id_score_list.values.values(),
+             output.id_score_list.scores(), 'id_score_list_scores'),
+        ]
+        input_blobs = [str(b) for b in input_record.field_blobs()]
+        for _, output_blob, suffix in expected:
+            self.assertNotIn(str(output_blob), input_blobs)
+            self.assertTrue(str(output_blob).endswith(suffix))
+        self.assertEqual(
+            [(str(i), str(o)) for i, o, _ in expected],
+            [(op.input[0], op.output[0]) for op in alias_ops])
+
+    def testFeatureSparseToDenseNoStrictAlias(self):
+        input_record, output, alias_ops = \
+            self._buildFeatureSparseToDenseIdLists(strict_alias=False)
+
+        self.assertEqual([], alias_ops)
+        self.assertEqual(
+            input_record.id_list.values.items(), output.id_list.values())
+        self.assertEqual(
+            input_record.id_score_list.values.keys(),
+            output.id_score_list.ids())
+        self.assertEqual(
+            input_record.id_score_list.values.values(),
+            output.id_score_list.scores())
+
+    def testFeatureSparseToDenseGetMetadata(self):
+        input_specs = [
+            ('float', schema.FeatureSpec(
+                feature_type='FLOAT',
+                feature_names=['a', 'b'],
+                feature_ids=[1, 2])),
+            ('id_list', schema.FeatureSpec(
+                feature_type='ID_LIST',
+                feature_names=['c'],
+                feature_ids=[3])),
+            ('id_score_list', schema.FeatureSpec(
+                feature_type='ID_SCORE_LIST',
+                feature_names=['d'],
+                feature_ids=[4])),
+        ]
+        input_record = self.new_record(schema.Struct(
+            ('float', schema.Map(np.int32, np.float32)),
+            ('id_list', schema.Map(np.int32, schema.List(np.int64))),
+            ('id_score_list',
+             schema.Map(np.int32, schema.Map(np.int64, np.float32))),
+        ))
+        output = self.model.FeatureSparseToDense(input_record, input_specs)
+        layer = self.model.layers[-1]
+
+        expected = []
+        for field, feature_specs in input_specs:
+            field_metadata = {
+                'type': feature_specs.feature_type,
+                'names': feature_specs.feature_names,
+                'ids': feature_specs.feature_ids,
+            }
+            if feature_specs.feature_type == 'FLOAT':
+                field_metadata['cardinality'] = 1
+            expected.append((
+                field_metadata,
+                output[field].field_blobs(),
+                output[field].field_types(),
+            ))
+
+        metadata = layer.get_metadata()
+        self.assertEqual(expected, metadata)
+
+        # Mutating the result must not leak into later calls
+        metadata[0][0]['type'] = 'ID_LIST'
+        metadata[0][1].append(core.BlobReference('unrelated_blob'))
+        metadata.pop()
+        self.assertEqual(expected, layer.get_metadata())
+
+    def testFeatureSparseToDenseMixedTypes(self):
+        input_record = self.new_record(schema.Struct(
+            ('float1', schema.Map(np.int32, np.float32)),
+            ('id_list', schema.Map(np.int32, schema.List(np.int64))),
+            ('float2', schema.Map(np.int32, np.float32)),
+        ))
+        schema.FeedRecord(
+            input_record,
+            [
+                np.array([2, 1], dtype=np.int32),
+                np.array([3, 1, 2], dtype=np.int32),
+                np.array([0.5, 1.5, 2.5], dtype=np.float32),
+                np.array([1, 0], dtype=np.int32),
+                np.array([11], dtype=np.int32),
+                np.array([2], dtype=np.int32),
+                np.array([5, 6], dtype=np.int64),
+                np.array([0, 1], dtype=np.int32),
+                np.array([7], dtype=np.int32),
+                np.array([4.0], dtype=np.float32),
+            ]
+        )
+        output = self.model.FeatureSparseToDense(
+            input_record,
+            [
+                ('float1', schema.FeatureSpec(
+                    feature_type='FLOAT',
+                    feature_names=['a', 'b', 'c'],
+                    feature_ids=[1, 2, 3])),
+                ('id_list', schema.FeatureSpec(
+                    feature_type='ID_LIST',
+                    feature_names=['d'],
+                    feature_ids=[11])),
+                ('float2', schema.FeatureSpec(
+                    feature_type='FLOAT',
+                    feature_names=['e'],
+                    feature_ids=[7])),
+            ]
+        )
+        self.assertEqual((3, ), output.float1.field_types()[0].shape)
+        self.assertEqual((1, ), output.float2.field_types()[0].shape)
+
+        # Ops follow the order of input_specs
+        _, train_net = self.get_training_nets()
+        self.assertEqual(
+            ['SparseToDenseMask', 'LengthsToRanges', 'SparseToDenseMask',
+             'Alias', 'SparseToDenseMask'],
+            [op.type for op in train_net.Proto().op])
+
+        self.run_train_net_forward_only()
+        # Ids missing from a row are filled with ZERO
+        npt.assert_array_equal(
+            np.array([[1.5, 0.0, 0.5], [0.0, 2.5, 0.0]], dtype=np.float32),
+            workspace.FetchBlob(output.float1()))
+        npt.assert_array_equal(
+            np.array([[0.0], [4.0]], dtype=np.float32),
+            workspace.FetchBlob(output.float2()))
+        npt.assert_array_equal(
+            [[[0, 2]], [[0, 0]]],
+            workspace.FetchBlob(output.id_list.ranges()))